@@ -4,10 +4,18 @@ Script to create AWS S3 buckets for a healthcare data lake with bronze, silver,
 For the Patient Outcome Prediction Pipeline project
 """
 
-import boto3
-import json
+import argparse
+import functools
 import logging
-from botocore.exceptions import ClientError
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import orjson
+
+# boto3/botocore are imported inside the functions that call AWS, so importing
+# this module for its bucket names, lifecycle rules or template builder does
+# not pay the SDK's import and endpoint-loading cost
 
 # Configure logging
 logging.basicConfig(
@@ -26,132 +34,489 @@ BRONZE_BUCKET = f"{PROJECT_NAME}-{ENVIRONMENT}-bronze-data"
 SILVER_BUCKET = f"{PROJECT_NAME}-{ENVIRONMENT}-silver-data"
 GOLD_BUCKET = f"{PROJECT_NAME}-{ENVIRONMENT}-gold-data"
 
-def create_bucket(bucket_name, region, tier):
+# Customer-managed KMS key (one per environment) used for default bucket encryption
+KMS_KEY_ALIAS = f"alias/{PROJECT_NAME}-{ENVIRONMENT}-data-lake"
+
+# CloudFormation stack that owns the buckets when provisioning declaratively
+STACK_NAME = f"{PROJECT_NAME}-{ENVIRONMENT}-data-lake"
+
+# HIPAA compliance tags shared by every bucket; only the DataTier tag varies
+_BASE_TAGS = [
+    {
+        'Key': 'Project',
+        'Value': 'PatientOutcomePrediction'
+    },
+    {
+        'Key': 'Environment',
+        'Value': ENVIRONMENT
+    },
+    {
+        'Key': 'Contains-PHI',
+        'Value': 'True'
+    },
+    {
+        'Key': 'Compliance',
+        'Value': 'HIPAA'
+    }
+]
+
+# Object layout contract for every tier: pipeline output is written under
+# data/ and job logs under logs/. Storage class transitions only apply to data
+# objects larger than 128 KB, the minimum billable object size of STANDARD_IA,
+# so small files are not moved into a class that charges them as 128 KB
+DATA_PREFIX = 'data/'
+LOGS_PREFIX = 'logs/'
+MIN_TRANSITION_OBJECT_SIZE = 128 * 1024
+
+def _tiering_rule(rule_id, transitions):
+    """
+    Builds a lifecycle rule moving data objects through storage classes
+    
+    Parameters:
+        rule_id (str): Lifecycle rule ID
+        transitions (list): Storage class transitions for the tier
+    
+    Returns:
+        dict: Lifecycle rule limited to large objects under DATA_PREFIX
+    """
+    return {
+        'ID': rule_id,
+        'Status': 'Enabled',
+        'Filter': {
+            'And': {
+                'Prefix': DATA_PREFIX,
+                'ObjectSizeGreaterThan': MIN_TRANSITION_OBJECT_SIZE
+            }
+        },
+        'Transitions': transitions
+    }
+
+# Applies to the whole bucket. Versioning is enabled, so overwritten/deleted
+# versions would otherwise stay at STANDARD pricing indefinitely, and expiring
+# an object leaves a delete marker behind that is removed here once no
+# versions remain under it. Kept separate from the tiering rule because S3
+# rejects AbortIncompleteMultipartUpload in rules filtered by object size
+_HOUSEKEEPING_RULE = {
+    'ID': 'Clean up noncurrent versions and incomplete uploads',
+    'Status': 'Enabled',
+    'Filter': {'Prefix': ''},
+    'Expiration': {'ExpiredObjectDeleteMarker': True},
+    'NoncurrentVersionTransitions': [
+        {
+            'NoncurrentDays': 30,
+            'StorageClass': 'GLACIER'
+        }
+    ],
+    'AbortIncompleteMultipartUpload': {'DaysAfterInitiation': 7}
+}
+
+# Job logs are only useful for a week; expire noncurrent versions too, otherwise
+# versioning keeps every expired log around
+_EXPIRE_LOGS_RULE = {
+    'ID': 'Expire logs',
+    'Status': 'Enabled',
+    'Filter': {'Prefix': LOGS_PREFIX},
+    'Expiration': {'Days': 7},
+    'NoncurrentVersionExpiration': {'NoncurrentDays': 7}
+}
+
+# Lifecycle configuration per data tier; these are constants, so they are built
+# once here and shared by every caller of get_lifecycle_config
+_LIFECYCLE_CONFIGS = {
+    # For raw data - move to infrequent access after 60 days, glacier after 180 days,
+    # deep archive after a year and expire once the 7-year HIPAA retention has passed
+    'bronze': {
+        'Rules': [
+            _tiering_rule('Move to IA, Glacier and Deep Archive', [
+                {
+                    'Days': 60,
+                    'StorageClass': 'STANDARD_IA'
+                },
+                {
+                    'Days': 180,
+                    'StorageClass': 'GLACIER'
+                },
+                {
+                    'Days': 365,
+                    'StorageClass': 'DEEP_ARCHIVE'
+                }
+            ]),
+            {
+                'ID': 'Expire after HIPAA retention period',
+                'Status': 'Enabled',
+                'Filter': {'Prefix': ''},
+                'Expiration': {'Days': 2555},
+                # Expiring a versioned object only makes it noncurrent, so the
+                # version itself has to be expired too. This applies to every
+                # noncurrent version, including ones overwritten or deleted by
+                # mistake, so they are kept for the full retention period as well
+                'NoncurrentVersionExpiration': {'NoncurrentDays': 2555}
+            },
+            _HOUSEKEEPING_RULE,
+            _EXPIRE_LOGS_RULE
+        ]
+    },
+    # For processed data - let Intelligent-Tiering follow the measured access
+    # pattern instead of fixed day thresholds. Deep archiving is left to the
+    # Intelligent-Tiering archive configuration below, which only archives
+    # objects that have actually gone unread; a DEEP_ARCHIVE lifecycle
+    # transition on top would archive everything by age and restart the
+    # 180-day minimum storage charge on objects already archived
+    'silver': {
+        'Rules': [
+            _tiering_rule('Move to Intelligent-Tiering', [
+                {
+                    'Days': 0,
+                    'StorageClass': 'INTELLIGENT_TIERING'
+                }
+            ]),
+            _HOUSEKEEPING_RULE,
+            _EXPIRE_LOGS_RULE
+        ]
+    },
+    # For analytics-ready data - same as silver, read patterns vary by consumer
+    'gold': {
+        'Rules': [
+            _tiering_rule('Move to Intelligent-Tiering', [
+                {
+                    'Days': 0,
+                    'StorageClass': 'INTELLIGENT_TIERING'
+                }
+            ]),
+            _HOUSEKEEPING_RULE,
+            _EXPIRE_LOGS_RULE
+        ]
+    }
+}
+
+# Opt-in Intelligent-Tiering archive tiers per data tier. Archived objects must
+# be restored before they can be read, so gold (read by analytics jobs) only
+# uses the automatic frequent/infrequent/archive-instant tiers
+_INTELLIGENT_TIERING_CONFIGS = {
+    'silver': {
+        'Id': 'ArchiveColdData',
+        'Status': 'Enabled',
+        'Tierings': [
+            {
+                'Days': 90,
+                'AccessTier': 'ARCHIVE_ACCESS'
+            },
+            {
+                'Days': 180,
+                'AccessTier': 'DEEP_ARCHIVE_ACCESS'
+            }
+        ]
+    }
+}
+
+# Shared S3 client settings: a pool large enough for every concurrent request,
+# TCP keep-alive so idle sockets survive between configuration calls instead of
+# paying for a new TLS handshake, and adaptive retries so a 503 SlowDown during
+# the concurrent configuration burst is met with client-side rate limiting and
+# jittered exponential backoff
+S3_CLIENT_SETTINGS = {
+    'max_pool_connections': 16,
+    'retries': {'max_attempts': 10, 'mode': 'adaptive'},
+    'tcp_keepalive': True
+}
+
+@functools.lru_cache(maxsize=None)
+def _get_client(service_name):
+    """
+    Returns a boto3 client for the data lake region, created once per service
+    
+    Parameters:
+        service_name (str): AWS service name (s3, kms, cloudformation)
+    
+    Returns:
+        botocore.client.BaseClient: Shared client for the service
+    """
+    import boto3
+    from botocore.config import Config
+    
+    if service_name == 's3':
+        return boto3.client('s3', region_name=AWS_REGION, config=Config(**S3_CLIENT_SETTINGS))
+    return boto3.client(service_name, region_name=AWS_REGION)
+
+def get_or_create_kms_key(kms):
+    """
+    Look up the environment's data lake KMS key by alias, creating it if needed
+    
+    Parameters:
+        kms (botocore.client.KMS): KMS client
+    
+    Returns:
+        str: ARN of the KMS key, or None on error
+    """
+    from botocore.exceptions import ClientError
+    
+    try:
+        key_metadata = kms.describe_key(KeyId=KMS_KEY_ALIAS)['KeyMetadata']
+        logger.info("Using existing KMS key %s", KMS_KEY_ALIAS)
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NotFoundException':
+            logger.error("Error looking up KMS key %s: %s", KMS_KEY_ALIAS, e)
+            return None
+        key_metadata = None
+    
+    if key_metadata is None:
+        try:
+            key_metadata = kms.create_key(
+                Description=f"Default encryption key for the {PROJECT_NAME} {ENVIRONMENT} data lake",
+                Tags=[
+                    {'TagKey': tag['Key'], 'TagValue': tag['Value']}
+                    for tag in _BASE_TAGS
+                ]
+            )['KeyMetadata']
+        except ClientError as e:
+            logger.error("Error creating KMS key %s: %s", KMS_KEY_ALIAS, e)
+            return None
+        
+        try:
+            kms.create_alias(AliasName=KMS_KEY_ALIAS, TargetKeyId=key_metadata['KeyId'])
+            logger.info("Created KMS key %s", KMS_KEY_ALIAS)
+        except ClientError as e:
+            # AlreadyExistsException means a concurrent run created the alias
+            # first; its key is used instead of failing the whole run
+            lost_race = e.response['Error']['Code'] == 'AlreadyExistsException'
+            if lost_race:
+                logger.info("KMS alias %s was created by another run, using its key", KMS_KEY_ALIAS)
+            else:
+                logger.error("Error creating KMS alias %s: %s", KMS_KEY_ALIAS, e)
+            
+            # Either way the alias does not point at the new key, so later runs
+            # would never find it; don't leave it behind as a billed orphan
+            try:
+                kms.schedule_key_deletion(KeyId=key_metadata['KeyId'], PendingWindowInDays=7)
+            except ClientError as e:
+                logger.error("Error scheduling deletion of KMS key %s: %s", key_metadata['KeyId'], e)
+            
+            if not lost_race:
+                return None
+            try:
+                key_metadata = kms.describe_key(KeyId=KMS_KEY_ALIAS)['KeyMetadata']
+            except ClientError as e:
+                logger.error("Error looking up KMS key %s: %s", KMS_KEY_ALIAS, e)
+                return None
+    
+    # Checked on every run rather than only at creation, so a key whose rotation
+    # could not be enabled earlier is fixed on the next run
+    try:
+        rotation = kms.get_key_rotation_status(KeyId=key_metadata['KeyId'])
+        if not rotation['KeyRotationEnabled']:
+            kms.enable_key_rotation(KeyId=key_metadata['KeyId'])
+            logger.info("Enabled key rotation on %s", KMS_KEY_ALIAS)
+    except ClientError as e:
+        logger.error("Error enabling key rotation on %s: %s", KMS_KEY_ALIAS, e)
+        return None
+    
+    return key_metadata['Arn']
+
+def _normalize_lifecycle_value(value):
+    """
+    Normalizes a lifecycle document so equivalent configurations compare equal
+    
+    S3 does not echo back exactly what was written: empty prefixes may come back
+    as an empty filter, unset flags as False, and rules or transitions in a
+    different order. Empty/false fields are dropped and lists are sorted
+    
+    Parameters:
+        value: Lifecycle rules, or any value nested inside them
+    
+    Returns:
+        Normalized copy of the value
+    """
+    if isinstance(value, dict):
+        normalized = {}
+        for key, item in value.items():
+            item = _normalize_lifecycle_value(item)
+            if item is None or item is False or item == '' or item == {} or item == []:
+                continue
+            normalized[key] = item
+        return normalized
+    if isinstance(value, list):
+        return sorted(
+            (_normalize_lifecycle_value(item) for item in value),
+            key=lambda item: orjson.dumps(item, option=orjson.OPT_SORT_KEYS)
+        )
+    return value
+
+def _put_lifecycle_config_if_changed(s3, bucket_name, lifecycle_config):
+    """
+    Apply a lifecycle configuration only if it differs from the bucket's current one
+    
+    Re-submitting an identical policy is not free: S3 re-evaluates the rules,
+    which can cause unnecessary transitions and early-deletion charges
+    
+    Parameters:
+        s3 (botocore.client.S3): Shared S3 client
+        bucket_name (str): Name of the bucket to configure
+        lifecycle_config (dict): Desired lifecycle configuration
+    
+    Returns:
+        bool: True if the configuration was written, False if it was already current
+    """
+    from botocore.exceptions import ClientError
+    
+    try:
+        current_rules = s3.get_bucket_lifecycle_configuration(Bucket=bucket_name)['Rules']
+    except ClientError:
+        # NoSuchLifecycleConfiguration, or unreadable; either way write it
+        current_rules = None
+    
+    desired_rules = lifecycle_config['Rules']
+    if current_rules is not None and (
+        _normalize_lifecycle_value(current_rules) == _normalize_lifecycle_value(desired_rules)
+    ):
+        logger.info("Lifecycle policy on %s is already up to date", bucket_name)
+        return False
+    
+    s3.put_bucket_lifecycle_configuration(
+        Bucket=bucket_name,
+        LifecycleConfiguration=lifecycle_config
+    )
+    return True
+
+def create_bucket(s3, bucket_name, region, tier, kms_key_arn):
     """
     Create an S3 bucket with appropriate settings for healthcare data
     
     Parameters:
+        s3 (botocore.client.S3): Shared S3 client used for all API calls
         bucket_name (str): Name of the bucket to create
         region (str): AWS region to create the bucket in
         tier (str): Data tier (bronze, silver, gold) to set appropriate policies
+        kms_key_arn (str): ARN of the KMS key used for default encryption
     
     Returns:
         bool: True if bucket was created or already exists, False on error
     """
-    s3_client = boto3.client('s3', region_name=region)
+    from botocore.exceptions import ClientError
     
-    logger.info(f"Creating {tier} tier bucket: {bucket_name}")
+    logger.info("Creating %s tier bucket: %s", tier, bucket_name)
     
-    # Create the bucket with the appropriate region configuration
+    # Probe for the bucket first so re-runs skip the create_bucket write
     try:
-        if region == 'us-east-1':
-            s3_client.create_bucket(Bucket=bucket_name)
-        else:
-            s3_client.create_bucket(
-                Bucket=bucket_name,
-                CreateBucketConfiguration={'LocationConstraint': region}
-            )
-        logger.info(f"Bucket {bucket_name} created successfully")
+        s3.head_bucket(Bucket=bucket_name)
+        exists = True
+        logger.info("Bucket %s already exists and is owned by you", bucket_name)
     except ClientError as e:
         error_code = e.response['Error']['Code']
-        if error_code == 'BucketAlreadyOwnedByYou':
-            logger.info(f"Bucket {bucket_name} already exists and is owned by you")
+        if error_code in ('404', 'NoSuchBucket'):
+            exists = False
         else:
-            logger.error(f"Error creating bucket {bucket_name}: {e}")
+            logger.error("Error checking bucket %s: %s", bucket_name, e)
             return False
     
-    # Enable versioning for data protection
-    try:
-        s3_client.put_bucket_versioning(
-            Bucket=bucket_name,
-            VersioningConfiguration={'Status': 'Enabled'}
-        )
-        logger.info(f"Enabled versioning on {bucket_name}")
-    except ClientError as e:
-        logger.error(f"Error enabling versioning on {bucket_name}: {e}")
-        return False
+    # Create the bucket with the appropriate region configuration. ACLs are
+    # disabled and Object Lock (WORM retention) is enabled as part of creation,
+    # so there is no window in which either is missing
+    if not exists:
+        create_kwargs = {
+            'Bucket': bucket_name,
+            'ObjectOwnership': 'BucketOwnerEnforced',
+            'ObjectLockEnabledForBucket': True
+        }
+        if region != 'us-east-1':
+            create_kwargs['CreateBucketConfiguration'] = {'LocationConstraint': region}
+        try:
+            s3.create_bucket(**create_kwargs)
+            logger.info("Bucket %s created successfully", bucket_name)
+        except ClientError as e:
+            error_code = e.response['Error']['Code']
+            if error_code == 'BucketAlreadyOwnedByYou':
+                exists = True
+                logger.info("Bucket %s already exists and is owned by you", bucket_name)
+            else:
+                logger.error("Error creating bucket %s: %s", bucket_name, e)
+                return False
     
-    # Enable default encryption for HIPAA compliance
-    try:
-        s3_client.put_bucket_encryption(
-            Bucket=bucket_name,
-            ServerSideEncryptionConfiguration={
+    # Configuration steps applied once the bucket exists, as
+    # (description, API call, keyword arguments)
+    steps = [
+        # Enable versioning for data protection
+        ('versioning', s3.put_bucket_versioning, {
+            'Bucket': bucket_name,
+            'VersioningConfiguration': {'Status': 'Enabled'}
+        }),
+        # Enable default KMS encryption for HIPAA compliance; the bucket key
+        # keeps KMS requests from scaling with the number of objects
+        ('encryption', s3.put_bucket_encryption, {
+            'Bucket': bucket_name,
+            'ServerSideEncryptionConfiguration': {
                 'Rules': [
                     {
                         'ApplyServerSideEncryptionByDefault': {
-                            'SSEAlgorithm': 'AES256'
+                            'SSEAlgorithm': 'aws:kms',
+                            'KMSMasterKeyID': kms_key_arn
                         },
                         'BucketKeyEnabled': True
                     }
                 ]
             }
-        )
-        logger.info(f"Enabled encryption on {bucket_name}")
-    except ClientError as e:
-        logger.error(f"Error enabling encryption on {bucket_name}: {e}")
-        return False
+        }),
+        # Set lifecycle policies based on tier
+        ('lifecycle policy', _put_lifecycle_config_if_changed, {
+            's3': s3,
+            'bucket_name': bucket_name,
+            'lifecycle_config': get_lifecycle_config(tier)
+        }),
+        # Add HIPAA compliance tags
+        ('compliance tags', s3.put_bucket_tagging, {
+            'Bucket': bucket_name,
+            'Tagging': {
+                'TagSet': _BASE_TAGS + [{'Key': 'DataTier', 'Value': tier}]
+            }
+        })
+    ]
     
-    # Block public access to all buckets (healthcare data security)
-    try:
-        s3_client.put_public_access_block(
-            Bucket=bucket_name,
-            PublicAccessBlockConfiguration={
+    # New buckets have ACLs disabled and every public access block setting
+    # enabled at creation; buckets that already existed may predate either, so
+    # apply both explicitly (healthcare data security). Object Lock is not
+    # retrofitted onto existing buckets: it cannot be turned off again, so
+    # enabling it on a bucket that was created without it is left to operators
+    if exists:
+        steps.append(('object ownership controls', s3.put_bucket_ownership_controls, {
+            'Bucket': bucket_name,
+            'OwnershipControls': {
+                'Rules': [{'ObjectOwnership': 'BucketOwnerEnforced'}]
+            }
+        }))
+        steps.append(('public access block', s3.put_public_access_block, {
+            'Bucket': bucket_name,
+            'PublicAccessBlockConfiguration': {
                 'BlockPublicAcls': True,
                 'IgnorePublicAcls': True,
                 'BlockPublicPolicy': True,
                 'RestrictPublicBuckets': True
             }
-        )
-        logger.info(f"Blocked public access on {bucket_name}")
-    except ClientError as e:
-        logger.error(f"Error blocking public access on {bucket_name}: {e}")
-        return False
+        }))
     
-    # Set lifecycle policies based on tier
-    lifecycle_config = get_lifecycle_config(tier)
-    try:
-        s3_client.put_bucket_lifecycle_configuration(
-            Bucket=bucket_name,
-            LifecycleConfiguration=lifecycle_config
-        )
-        logger.info(f"Set lifecycle policy for {tier} tier on {bucket_name}")
-    except ClientError as e:
-        logger.error(f"Error setting lifecycle policy on {bucket_name}: {e}")
-        return False
-    
-    # Add HIPAA compliance tags
-    try:
-        s3_client.put_bucket_tagging(
-            Bucket=bucket_name,
-            Tagging={
-                'TagSet': [
-                    {
-                        'Key': 'Project',
-                        'Value': 'PatientOutcomePrediction'
-                    },
-                    {
-                        'Key': 'Environment',
-                        'Value': ENVIRONMENT
-                    },
-                    {
-                        'Key': 'DataTier',
-                        'Value': tier
-                    },
-                    {
-                        'Key': 'Contains-PHI',
-                        'Value': 'True'
-                    },
-                    {
-                        'Key': 'Compliance',
-                        'Value': 'HIPAA'
-                    }
-                ]
+    # Register the archive access tiers where the data tier uses them
+    tiering_config = _INTELLIGENT_TIERING_CONFIGS.get(tier)
+    if tiering_config:
+        steps.append((
+            'Intelligent-Tiering archive configuration',
+            s3.put_bucket_intelligent_tiering_configuration,
+            {
+                'Bucket': bucket_name,
+                'Id': tiering_config['Id'],
+                'IntelligentTieringConfiguration': tiering_config
             }
-        )
-        logger.info(f"Added compliance tags to {bucket_name}")
-    except ClientError as e:
-        logger.error(f"Error adding tags to {bucket_name}: {e}")
-        return False
+        ))
+    
+    # The steps run one after another: S3 rejects concurrent configuration
+    # writes to the same bucket with 409 OperationAborted, which botocore does
+    # not retry. Buckets are still provisioned in parallel by create_data_lake
+    for description, api_call, kwargs in steps:
+        try:
+            # API calls return their response; helpers that may skip the
+            # write return False when there was nothing to apply
+            if api_call(**kwargs) is not False:
+                logger.info("Applied %s to %s", description, bucket_name)
+        except ClientError as e:
+            logger.error("Error applying %s to %s: %s", description, bucket_name, e)
+            return False
     
     return True
 
@@ -163,71 +528,266 @@ def get_lifecycle_config(tier):
         tier (str): Data tier (bronze, silver, gold)
     
     Returns:
-        dict: Lifecycle configuration
+        dict: Lifecycle configuration (shared, do not mutate)
     """
-    if tier == "bronze":
-        # For raw data - move to infrequent access after 60 days, glacier after 180 days
-        return {
-            'Rules': [
-                {
-                    'ID': 'Move to IA and Glacier',
-                    'Status': 'Enabled',
-                    'Filter': {'Prefix': ''},
-                    'Transitions': [
-                        {
-                            'Days': 60,
-                            'StorageClass': 'STANDARD_IA'
-                        },
-                        {
-                            'Days': 180,
-                            'StorageClass': 'GLACIER'
-                        }
-                    ]
-                }
-            ]
+    return _LIFECYCLE_CONFIGS.get(tier, _LIFECYCLE_CONFIGS['gold'])
+
+def _to_cfn_lifecycle_rule(rule):
+    """
+    Converts an S3 API lifecycle rule into the AWS::S3::Bucket Rule shape
+    
+    Parameters:
+        rule (dict): Lifecycle rule as accepted by put_bucket_lifecycle_configuration
+    
+    Returns:
+        dict: Equivalent CloudFormation lifecycle rule
+    """
+    cfn_rule = {
+        'Id': rule['ID'],
+        'Status': rule['Status']
+    }
+    rule_filter = rule['Filter'].get('And', rule['Filter'])
+    if rule_filter.get('Prefix'):
+        cfn_rule['Prefix'] = rule_filter['Prefix']
+    if 'ObjectSizeGreaterThan' in rule_filter:
+        cfn_rule['ObjectSizeGreaterThan'] = str(rule_filter['ObjectSizeGreaterThan'])
+    if 'Transitions' in rule:
+        cfn_rule['Transitions'] = [
+            {
+                'TransitionInDays': transition['Days'],
+                'StorageClass': transition['StorageClass']
+            }
+            for transition in rule['Transitions']
+        ]
+    if 'NoncurrentVersionTransitions' in rule:
+        cfn_rule['NoncurrentVersionTransitions'] = [
+            {
+                'TransitionInDays': transition['NoncurrentDays'],
+                'StorageClass': transition['StorageClass']
+            }
+            for transition in rule['NoncurrentVersionTransitions']
+        ]
+    if 'Days' in rule.get('Expiration', {}):
+        cfn_rule['ExpirationInDays'] = rule['Expiration']['Days']
+    if rule.get('Expiration', {}).get('ExpiredObjectDeleteMarker'):
+        cfn_rule['ExpiredObjectDeleteMarker'] = True
+    if 'NoncurrentVersionExpiration' in rule:
+        cfn_rule['NoncurrentVersionExpiration'] = rule['NoncurrentVersionExpiration']
+    if 'AbortIncompleteMultipartUpload' in rule:
+        cfn_rule['AbortIncompleteMultipartUpload'] = rule['AbortIncompleteMultipartUpload']
+    return cfn_rule
+
+def get_cloudformation_template(buckets):
+    """
+    Builds a CloudFormation template declaring the data lake KMS key and every
+    bucket with the same versioning, encryption, public access, lifecycle and
+    tagging settings that create_bucket applies call by call
+    
+    Parameters:
+        buckets (dict): Mapping of data tier to bucket name
+    
+    Returns:
+        dict: CloudFormation template
+    """
+    resources = {
+        'DataLakeKey': {
+            'Type': 'AWS::KMS::Key',
+            'DeletionPolicy': 'Retain',
+            'UpdateReplacePolicy': 'Retain',
+            'Properties': {
+                'Description': f"Default encryption key for the {PROJECT_NAME} {ENVIRONMENT} data lake",
+                'EnableKeyRotation': True,
+                'Tags': _BASE_TAGS
+            }
+        },
+        'DataLakeKeyAlias': {
+            'Type': 'AWS::KMS::Alias',
+            'Properties': {
+                'AliasName': KMS_KEY_ALIAS,
+                'TargetKeyId': {'Ref': 'DataLakeKey'}
+            }
         }
-    elif tier == "silver":
-        # For processed data - move to infrequent access after 30 days, glacier after 90 days
-        return {
-            'Rules': [
-                {
-                    'ID': 'Move to IA and Glacier',
-                    'Status': 'Enabled',
-                    'Filter': {'Prefix': ''},
-                    'Transitions': [
-                        {
-                            'Days': 30,
-                            'StorageClass': 'STANDARD_IA'
-                        },
+    }
+    for tier, bucket_name in buckets.items():
+        lifecycle_config = get_lifecycle_config(tier)
+        bucket = {
+            'Type': 'AWS::S3::Bucket',
+            # Never let a stack deletion or replacement remove PHI
+            'DeletionPolicy': 'Retain',
+            'UpdateReplacePolicy': 'Retain',
+            'Properties': {
+                'BucketName': bucket_name,
+                'ObjectLockEnabled': True,
+                'OwnershipControls': {
+                    'Rules': [{'ObjectOwnership': 'BucketOwnerEnforced'}]
+                },
+                'VersioningConfiguration': {'Status': 'Enabled'},
+                'BucketEncryption': {
+                    'ServerSideEncryptionConfiguration': [
                         {
-                            'Days': 90,
-                            'StorageClass': 'GLACIER'
+                            'ServerSideEncryptionByDefault': {
+                                'SSEAlgorithm': 'aws:kms',
+                                'KMSMasterKeyID': {'Fn::GetAtt': ['DataLakeKey', 'Arn']}
+                            },
+                            'BucketKeyEnabled': True
                         }
                     ]
-                }
-            ]
+                },
+                'PublicAccessBlockConfiguration': {
+                    'BlockPublicAcls': True,
+                    'IgnorePublicAcls': True,
+                    'BlockPublicPolicy': True,
+                    'RestrictPublicBuckets': True
+                },
+                'LifecycleConfiguration': {
+                    'Rules': [
+                        _to_cfn_lifecycle_rule(rule)
+                        for rule in lifecycle_config['Rules']
+                    ]
+                },
+                'Tags': _BASE_TAGS + [{'Key': 'DataTier', 'Value': tier}]
+            }
         }
-    else:  # gold
-        # For analytics-ready data - move to infrequent access after 30 days
-        return {
-            'Rules': [
+        
+        tiering_config = _INTELLIGENT_TIERING_CONFIGS.get(tier)
+        if tiering_config:
+            bucket['Properties']['IntelligentTieringConfigurations'] = [
                 {
-                    'ID': 'Move to IA',
-                    'Status': 'Enabled',
-                    'Filter': {'Prefix': ''},
-                    'Transitions': [
+                    'Id': tiering_config['Id'],
+                    'Status': tiering_config['Status'],
+                    'Tierings': [
                         {
-                            'Days': 30,
-                            'StorageClass': 'STANDARD_IA'
+                            'AccessTier': tiering['AccessTier'],
+                            'Days': tiering['Days']
                         }
+                        for tiering in tiering_config['Tierings']
                     ]
                 }
             ]
-        }
+        
+        resources[f"{tier.capitalize()}Bucket"] = bucket
+    
+    return {
+        'AWSTemplateFormatVersion': '2010-09-09',
+        'Description': 'Bronze, silver and gold S3 buckets for the Patient Outcome Prediction data lake',
+        'Resources': resources
+    }
+
+def deploy_data_lake_stack(cfn, buckets):
+    """
+    Create or update the data lake CloudFormation stack and wait for it to settle
+    
+    The stack must own the buckets and the KMS alias it declares, so it cannot
+    be deployed in an environment already provisioned by create_bucket and
+    get_or_create_kms_key: stack creation fails on the existing bucket names
+    and on the existing KMS_KEY_ALIAS alias
+    
+    Parameters:
+        cfn (botocore.client.CloudFormation): CloudFormation client
+        buckets (dict): Mapping of data tier to bucket name
+    
+    Returns:
+        bool: True if the stack is up to date, False on error
+    """
+    from botocore.exceptions import ClientError, WaiterError
+    
+    template_body = orjson.dumps(get_cloudformation_template(buckets)).decode()
+    
+    try:
+        stack_status = cfn.describe_stacks(StackName=STACK_NAME)['Stacks'][0]['StackStatus']
+        stack_exists = True
+    except ClientError as e:
+        if 'does not exist' in e.response['Error']['Message']:
+            stack_exists = False
+        else:
+            logger.error("Error describing stack %s: %s", STACK_NAME, e)
+            return False
+    
+    # A stack whose creation failed and rolled back can only be deleted, never
+    # updated. Its buckets and key are retained, so deleting it loses no data,
+    # but that is left to an operator rather than done automatically
+    if stack_exists and stack_status in ('ROLLBACK_COMPLETE', 'ROLLBACK_FAILED'):
+        logger.error(
+            "Stack %s is in %s after a failed creation and must be deleted before it can be redeployed",
+            STACK_NAME, stack_status
+        )
+        return False
+    
+    try:
+        if stack_exists:
+            logger.info("Updating stack %s", STACK_NAME)
+            cfn.update_stack(
+                StackName=STACK_NAME,
+                TemplateBody=template_body
+            )
+            waiter = cfn.get_waiter('stack_update_complete')
+        else:
+            logger.info("Creating stack %s", STACK_NAME)
+            cfn.create_stack(
+                StackName=STACK_NAME,
+                TemplateBody=template_body
+            )
+            waiter = cfn.get_waiter('stack_create_complete')
+    except ClientError as e:
+        if 'No updates are to be performed' in e.response['Error']['Message']:
+            logger.info("Stack %s is already up to date", STACK_NAME)
+            return True
+        logger.error("Error submitting stack %s: %s", STACK_NAME, e)
+        return False
+    
+    try:
+        waiter.wait(StackName=STACK_NAME)
+    except WaiterError as e:
+        logger.error("Stack %s did not complete: %s", STACK_NAME, e)
+        return False
+    
+    logger.info("Stack %s deployed successfully", STACK_NAME)
+    return True
 
-def create_data_lake():
+def write_config(config, path):
+    """
+    Atomically write the data lake configuration as JSON
+    
+    The file is written to a temporary file in the same directory, flushed to
+    disk and renamed over the target, so downstream pipelines never read a
+    partially written file, even after a crash or power loss
+    
+    Parameters:
+        config (dict): Configuration to write
+        path (str): Destination file path
+    """
+    data = orjson.dumps(config, option=orjson.OPT_INDENT_2)
+    directory = os.path.dirname(os.path.abspath(path))
+    
+    # mkstemp creates the file as 0600; keep the existing file's mode, or use
+    # the mode open() would have given a new file, so other users and
+    # containers can still read the config
+    try:
+        mode = os.stat(path).st_mode & 0o777
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+    
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='data_lake_config.', suffix='.json')
+    try:
+        os.fchmod(fd, mode)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def create_data_lake(use_cloudformation=False):
     """
     Create all three tiers of the data lake
+    
+    Parameters:
+        use_cloudformation (bool): Provision the buckets through a single
+            CloudFormation stack instead of individual S3 API calls
     """
     buckets = {
         "bronze": BRONZE_BUCKET,
@@ -235,16 +795,32 @@ def create_data_lake():
         "gold": GOLD_BUCKET
     }
     
-    success = True
-    for tier, bucket_name in buckets.items():
-        if not create_bucket(bucket_name, AWS_REGION, tier):
-            success = False
+    if use_cloudformation:
+        success = deploy_data_lake_stack(_get_client('cloudformation'), buckets)
+    else:
+        # One client for every bucket so credential/endpoint resolution happens once
+        # and the underlying HTTP connection pool is reused across all API calls
+        s3 = _get_client('s3')
+        
+        kms_key_arn = get_or_create_kms_key(_get_client('kms'))
+        if kms_key_arn is None:
+            logger.error("❌ Failed to create some data lake buckets")
+            return False
+        
+        # Buckets are independent of each other, so provision them concurrently;
+        # the client's connection pool is sized to cover every in-flight request
+        with ThreadPoolExecutor(max_workers=len(buckets)) as executor:
+            results = list(executor.map(
+                lambda item: create_bucket(s3, item[1], AWS_REGION, item[0], kms_key_arn),
+                buckets.items()
+            ))
+        success = all(results)
     
     if success:
         logger.info("✅ Data lake S3 buckets created successfully!")
-        logger.info(f"Bronze tier: {BRONZE_BUCKET} (raw data storage)")
-        logger.info(f"Silver tier: {SILVER_BUCKET} (processed/transformed data)")
-        logger.info(f"Gold tier: {GOLD_BUCKET} (analytics-ready data)")
+        logger.info("Bronze tier: %s (raw data storage)", BRONZE_BUCKET)
+        logger.info("Silver tier: %s (processed/transformed data)", SILVER_BUCKET)
+        logger.info("Gold tier: %s (analytics-ready data)", GOLD_BUCKET)
         
         # Output bucket information to a configuration file for reference
         config = {
@@ -255,11 +831,17 @@ def create_data_lake():
                 "bronze": BRONZE_BUCKET,
                 "silver": SILVER_BUCKET,
                 "gold": GOLD_BUCKET
+            },
+            # Region and regional endpoint per bucket, so consumers can build
+            # region-pinned clients instead of re-resolving each bucket's region
+            "region_per_bucket": {tier: AWS_REGION for tier in buckets},
+            "endpoints": {
+                tier: f"https://{bucket_name}.s3.{AWS_REGION}.amazonaws.com"
+                for tier, bucket_name in buckets.items()
             }
         }
         
-        with open('data_lake_config.json', 'w') as f:
-            json.dump(config, f, indent=2)
+        write_config(config, 'data_lake_config.json')
         
         logger.info("Configuration saved to data_lake_config.json")
         return True
@@ -268,4 +850,11 @@ def create_data_lake():
         return False
 
 if __name__ == "__main__":
-    create_data_lake()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Create the data lake S3 buckets")
+    parser.add_argument(
+        '--cloudformation',
+        action='store_true',
+        help="Provision the buckets through a single CloudFormation stack"
+    )
+    args = parser.parse_args()
+    create_data_lake(use_cloudformation=args.cloudformation)
\ No newline at end of file
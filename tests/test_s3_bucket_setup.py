@@ -0,0 +1,443 @@
+"""
+Tests for the data lake S3 bucket setup script
+"""
+
+import os
+import stat
+
+import boto3
+import orjson
+import pytest
+from botocore.stub import Stubber
+
+import s3_bucket_setup
+
+
+@pytest.fixture
+def s3():
+    """S3 client with fake credentials so no request ever leaves the stubber"""
+    return boto3.client(
+        's3',
+        region_name='us-west-2',
+        aws_access_key_id='testing',
+        aws_secret_access_key='testing'
+    )
+
+
+def gold_lifecycle_response():
+    """
+    The gold tier's rules as GetBucketLifecycleConfiguration returns them:
+    rules in a different order, the empty prefix echoed back inside the filter,
+    and the bucket-level minimum object size setting alongside the rules
+    """
+    return {
+        'TransitionDefaultMinimumObjectSize': 'all_storage_classes_128K',
+        'Rules': [
+            {
+                'Expiration': {'Days': 7},
+                'ID': 'Expire logs',
+                'Filter': {'Prefix': 'logs/'},
+                'Status': 'Enabled',
+                'NoncurrentVersionExpiration': {'NoncurrentDays': 7}
+            },
+            {
+                'Expiration': {'ExpiredObjectDeleteMarker': True},
+                'ID': 'Clean up noncurrent versions and incomplete uploads',
+                'Filter': {'Prefix': ''},
+                'Status': 'Enabled',
+                'NoncurrentVersionTransitions': [
+                    {'NoncurrentDays': 30, 'StorageClass': 'GLACIER'}
+                ],
+                'AbortIncompleteMultipartUpload': {'DaysAfterInitiation': 7}
+            },
+            {
+                'ID': 'Move to Intelligent-Tiering',
+                'Filter': {
+                    'And': {'Prefix': 'data/', 'ObjectSizeGreaterThan': 131072}
+                },
+                'Status': 'Enabled',
+                'Transitions': [
+                    {'Days': 0, 'StorageClass': 'INTELLIGENT_TIERING'}
+                ]
+            }
+        ]
+    }
+
+
+def test_lifecycle_unchanged_skips_put(s3):
+    with Stubber(s3) as stubber:
+        stubber.add_response(
+            'get_bucket_lifecycle_configuration',
+            gold_lifecycle_response(),
+            {'Bucket': 'gold-bucket'}
+        )
+        # A put_bucket_lifecycle_configuration call would fail: it is not stubbed
+        assert not s3_bucket_setup._put_lifecycle_config_if_changed(
+            s3, 'gold-bucket', s3_bucket_setup.get_lifecycle_config('gold')
+        )
+        stubber.assert_no_pending_responses()
+
+
+def test_lifecycle_changed_is_put(s3):
+    response = gold_lifecycle_response()
+    response['Rules'][0]['Expiration'] = {'Days': 30}
+    lifecycle_config = s3_bucket_setup.get_lifecycle_config('gold')
+    with Stubber(s3) as stubber:
+        stubber.add_response(
+            'get_bucket_lifecycle_configuration',
+            response,
+            {'Bucket': 'gold-bucket'}
+        )
+        stubber.add_response(
+            'put_bucket_lifecycle_configuration',
+            {},
+            {'Bucket': 'gold-bucket', 'LifecycleConfiguration': lifecycle_config}
+        )
+        assert s3_bucket_setup._put_lifecycle_config_if_changed(s3, 'gold-bucket', lifecycle_config)
+        stubber.assert_no_pending_responses()
+
+
+def test_missing_lifecycle_is_put(s3):
+    lifecycle_config = s3_bucket_setup.get_lifecycle_config('bronze')
+    with Stubber(s3) as stubber:
+        stubber.add_client_error(
+            'get_bucket_lifecycle_configuration',
+            service_error_code='NoSuchLifecycleConfiguration',
+            http_status_code=404
+        )
+        stubber.add_response(
+            'put_bucket_lifecycle_configuration',
+            {},
+            {'Bucket': 'bronze-bucket', 'LifecycleConfiguration': lifecycle_config}
+        )
+        assert s3_bucket_setup._put_lifecycle_config_if_changed(s3, 'bronze-bucket', lifecycle_config)
+        stubber.assert_no_pending_responses()
+
+
+def test_unknown_tier_falls_back_to_gold_lifecycle():
+    assert s3_bucket_setup.get_lifecycle_config('platinum') is s3_bucket_setup.get_lifecycle_config('gold')
+
+
+@pytest.mark.parametrize('tier', ['bronze', 'silver', 'gold'])
+def test_template_bucket_matches_tier_settings(tier):
+    template = s3_bucket_setup.get_cloudformation_template({tier: f"{tier}-bucket"})
+    properties = template['Resources'][f"{tier.capitalize()}Bucket"]['Properties']
+    
+    assert properties['BucketName'] == f"{tier}-bucket"
+    assert properties['ObjectLockEnabled'] is True
+    assert properties['BucketEncryption']['ServerSideEncryptionConfiguration'][0] == {
+        'ServerSideEncryptionByDefault': {
+            'SSEAlgorithm': 'aws:kms',
+            'KMSMasterKeyID': {'Fn::GetAtt': ['DataLakeKey', 'Arn']}
+        },
+        'BucketKeyEnabled': True
+    }
+    assert {'Key': 'DataTier', 'Value': tier} in properties['Tags']
+    
+    rules = {rule['Id']: rule for rule in properties['LifecycleConfiguration']['Rules']}
+    api_rules = s3_bucket_setup.get_lifecycle_config(tier)['Rules']
+    assert len(rules) == len(api_rules)
+    
+    # The And filter is flattened onto the rule, with the size as a string
+    tiering_rule = rules[api_rules[0]['ID']]
+    assert tiering_rule['Prefix'] == 'data/'
+    assert tiering_rule['ObjectSizeGreaterThan'] == '131072'
+    assert tiering_rule['Transitions'] == [
+        {'TransitionInDays': transition['Days'], 'StorageClass': transition['StorageClass']}
+        for transition in api_rules[0]['Transitions']
+    ]
+    
+    housekeeping_rule = rules['Clean up noncurrent versions and incomplete uploads']
+    assert 'Prefix' not in housekeeping_rule
+    assert housekeeping_rule['NoncurrentVersionTransitions'] == [
+        {'TransitionInDays': 30, 'StorageClass': 'GLACIER'}
+    ]
+    assert housekeeping_rule['ExpiredObjectDeleteMarker'] is True
+    assert housekeeping_rule['AbortIncompleteMultipartUpload'] == {'DaysAfterInitiation': 7}
+    
+    logs_rule = rules['Expire logs']
+    assert logs_rule['Prefix'] == 'logs/'
+    assert logs_rule['ExpirationInDays'] == 7
+    assert logs_rule['NoncurrentVersionExpiration'] == {'NoncurrentDays': 7}
+
+
+def test_template_bronze_retention_rule():
+    template = s3_bucket_setup.get_cloudformation_template({'bronze': 'bronze-bucket'})
+    rules = template['Resources']['BronzeBucket']['Properties']['LifecycleConfiguration']['Rules']
+    retention_rule = next(rule for rule in rules if rule['Id'] == 'Expire after HIPAA retention period')
+    assert retention_rule['ExpirationInDays'] == 2555
+    assert retention_rule['NoncurrentVersionExpiration'] == {'NoncurrentDays': 2555}
+
+
+def test_template_intelligent_tiering_archive_only_on_silver():
+    template = s3_bucket_setup.get_cloudformation_template({
+        'bronze': 'bronze-bucket',
+        'silver': 'silver-bucket',
+        'gold': 'gold-bucket'
+    })
+    resources = template['Resources']
+    
+    assert resources['SilverBucket']['Properties']['IntelligentTieringConfigurations'] == [
+        {
+            'Id': 'ArchiveColdData',
+            'Status': 'Enabled',
+            'Tierings': [
+                {'AccessTier': 'ARCHIVE_ACCESS', 'Days': 90},
+                {'AccessTier': 'DEEP_ARCHIVE_ACCESS', 'Days': 180}
+            ]
+        }
+    ]
+    assert 'IntelligentTieringConfigurations' not in resources['BronzeBucket']['Properties']
+    assert 'IntelligentTieringConfigurations' not in resources['GoldBucket']['Properties']
+    assert resources['DataLakeKeyAlias']['Properties']['AliasName'] == s3_bucket_setup.KMS_KEY_ALIAS
+
+
+@pytest.fixture
+def umask_022():
+    previous = os.umask(0o022)
+    yield
+    os.umask(previous)
+
+
+def test_write_config_creates_readable_file(tmp_path, umask_022):
+    path = tmp_path / 'data_lake_config.json'
+    s3_bucket_setup.write_config({'region': 'us-west-2'}, str(path))
+    
+    assert orjson.loads(path.read_bytes()) == {'region': 'us-west-2'}
+    assert stat.S_IMODE(path.stat().st_mode) == 0o644
+    assert os.listdir(tmp_path) == ['data_lake_config.json']
+
+
+def test_write_config_keeps_existing_mode(tmp_path, umask_022):
+    path = tmp_path / 'data_lake_config.json'
+    path.write_text('{}')
+    path.chmod(0o640)
+    
+    s3_bucket_setup.write_config({'region': 'us-west-2'}, str(path))
+    
+    assert orjson.loads(path.read_bytes()) == {'region': 'us-west-2'}
+    assert stat.S_IMODE(path.stat().st_mode) == 0o640
+
+
+def test_write_config_failure_leaves_original(tmp_path, monkeypatch):
+    path = tmp_path / 'data_lake_config.json'
+    path.write_text('{"region": "us-east-1"}')
+    
+    def failing_replace(src, dst):
+        raise OSError("disk full")
+    
+    monkeypatch.setattr(s3_bucket_setup.os, 'replace', failing_replace)
+    with pytest.raises(OSError):
+        s3_bucket_setup.write_config({'region': 'us-west-2'}, str(path))
+    
+    assert path.read_text() == '{"region": "us-east-1"}'
+    assert os.listdir(tmp_path) == ['data_lake_config.json']
+
+
+@pytest.fixture
+def kms():
+    """KMS client with fake credentials so no request ever leaves the stubber"""
+    return boto3.client(
+        'kms',
+        region_name='us-west-2',
+        aws_access_key_id='testing',
+        aws_secret_access_key='testing'
+    )
+
+
+def key_metadata(key_id):
+    return {
+        'KeyMetadata': {
+            'KeyId': key_id,
+            'Arn': f"arn:aws:kms:us-west-2:123456789012:key/{key_id}"
+        }
+    }
+
+
+def test_kms_existing_key_is_reused(kms):
+    with Stubber(kms) as stubber:
+        stubber.add_response('describe_key', key_metadata('existing'), {'KeyId': s3_bucket_setup.KMS_KEY_ALIAS})
+        stubber.add_response('get_key_rotation_status', {'KeyRotationEnabled': True}, {'KeyId': 'existing'})
+        
+        assert s3_bucket_setup.get_or_create_kms_key(kms) == key_metadata('existing')['KeyMetadata']['Arn']
+        stubber.assert_no_pending_responses()
+
+
+def test_kms_existing_key_gets_rotation_enabled(kms):
+    with Stubber(kms) as stubber:
+        stubber.add_response('describe_key', key_metadata('existing'), {'KeyId': s3_bucket_setup.KMS_KEY_ALIAS})
+        stubber.add_response('get_key_rotation_status', {'KeyRotationEnabled': False}, {'KeyId': 'existing'})
+        stubber.add_response('enable_key_rotation', {}, {'KeyId': 'existing'})
+        
+        assert s3_bucket_setup.get_or_create_kms_key(kms) == key_metadata('existing')['KeyMetadata']['Arn']
+        stubber.assert_no_pending_responses()
+
+
+def test_kms_lookup_error_fails(kms):
+    with Stubber(kms) as stubber:
+        stubber.add_client_error('describe_key', service_error_code='AccessDeniedException')
+        
+        assert s3_bucket_setup.get_or_create_kms_key(kms) is None
+        stubber.assert_no_pending_responses()
+
+
+def test_kms_missing_key_is_created(kms):
+    with Stubber(kms) as stubber:
+        stubber.add_client_error('describe_key', service_error_code='NotFoundException')
+        stubber.add_response('create_key', key_metadata('new'))
+        stubber.add_response(
+            'create_alias',
+            {},
+            {'AliasName': s3_bucket_setup.KMS_KEY_ALIAS, 'TargetKeyId': 'new'}
+        )
+        stubber.add_response('get_key_rotation_status', {'KeyRotationEnabled': False}, {'KeyId': 'new'})
+        stubber.add_response('enable_key_rotation', {}, {'KeyId': 'new'})
+        
+        assert s3_bucket_setup.get_or_create_kms_key(kms) == key_metadata('new')['KeyMetadata']['Arn']
+        stubber.assert_no_pending_responses()
+
+
+def test_kms_alias_failure_schedules_key_deletion(kms):
+    with Stubber(kms) as stubber:
+        stubber.add_client_error('describe_key', service_error_code='NotFoundException')
+        stubber.add_response('create_key', key_metadata('new'))
+        stubber.add_client_error('create_alias', service_error_code='AccessDeniedException')
+        stubber.add_response('schedule_key_deletion', {}, {'KeyId': 'new', 'PendingWindowInDays': 7})
+        
+        assert s3_bucket_setup.get_or_create_kms_key(kms) is None
+        stubber.assert_no_pending_responses()
+
+
+def test_kms_alias_race_uses_winning_key(kms):
+    with Stubber(kms) as stubber:
+        stubber.add_client_error('describe_key', service_error_code='NotFoundException')
+        stubber.add_response('create_key', key_metadata('new'))
+        stubber.add_client_error('create_alias', service_error_code='AlreadyExistsException')
+        stubber.add_response('schedule_key_deletion', {}, {'KeyId': 'new', 'PendingWindowInDays': 7})
+        stubber.add_response('describe_key', key_metadata('winner'), {'KeyId': s3_bucket_setup.KMS_KEY_ALIAS})
+        stubber.add_response('get_key_rotation_status', {'KeyRotationEnabled': True}, {'KeyId': 'winner'})
+        
+        assert s3_bucket_setup.get_or_create_kms_key(kms) == key_metadata('winner')['KeyMetadata']['Arn']
+        stubber.assert_no_pending_responses()
+
+
+KMS_KEY_ARN = 'arn:aws:kms:us-west-2:123456789012:key/data-lake'
+
+
+def add_configuration_responses(stubber, bucket_name, exists):
+    """Queue the gold tier's configuration steps, in the order create_bucket applies them"""
+    stubber.add_response('put_bucket_versioning', {}, None)
+    stubber.add_response('put_bucket_encryption', {}, None)
+    stubber.add_client_error(
+        'get_bucket_lifecycle_configuration',
+        service_error_code='NoSuchLifecycleConfiguration',
+        http_status_code=404
+    )
+    stubber.add_response('put_bucket_lifecycle_configuration', {}, None)
+    stubber.add_response('put_bucket_tagging', {}, None)
+    if exists:
+        stubber.add_response(
+            'put_bucket_ownership_controls',
+            {},
+            {
+                'Bucket': bucket_name,
+                'OwnershipControls': {'Rules': [{'ObjectOwnership': 'BucketOwnerEnforced'}]}
+            }
+        )
+        stubber.add_response('put_public_access_block', {}, None)
+
+
+def test_missing_bucket_is_created(s3):
+    with Stubber(s3) as stubber:
+        stubber.add_client_error('head_bucket', service_error_code='404', http_status_code=404)
+        stubber.add_response(
+            'create_bucket',
+            {},
+            {
+                'Bucket': 'gold-bucket',
+                'ObjectOwnership': 'BucketOwnerEnforced',
+                'ObjectLockEnabledForBucket': True,
+                'CreateBucketConfiguration': {'LocationConstraint': 'us-west-2'}
+            }
+        )
+        # New buckets skip the ownership and public access block steps; an
+        # unstubbed call to either would fail the test
+        add_configuration_responses(stubber, 'gold-bucket', exists=False)
+        
+        assert s3_bucket_setup.create_bucket(s3, 'gold-bucket', 'us-west-2', 'gold', KMS_KEY_ARN)
+        stubber.assert_no_pending_responses()
+
+
+def test_existing_bucket_is_not_recreated(s3):
+    with Stubber(s3) as stubber:
+        stubber.add_response('head_bucket', {}, {'Bucket': 'gold-bucket'})
+        add_configuration_responses(stubber, 'gold-bucket', exists=True)
+        
+        assert s3_bucket_setup.create_bucket(s3, 'gold-bucket', 'us-west-2', 'gold', KMS_KEY_ARN)
+        stubber.assert_no_pending_responses()
+
+
+def test_bucket_created_concurrently_is_treated_as_existing(s3):
+    with Stubber(s3) as stubber:
+        stubber.add_client_error('head_bucket', service_error_code='404', http_status_code=404)
+        stubber.add_client_error(
+            'create_bucket',
+            service_error_code='BucketAlreadyOwnedByYou',
+            http_status_code=409
+        )
+        add_configuration_responses(stubber, 'gold-bucket', exists=True)
+        
+        assert s3_bucket_setup.create_bucket(s3, 'gold-bucket', 'us-west-2', 'gold', KMS_KEY_ARN)
+        stubber.assert_no_pending_responses()
+
+
+def test_bucket_probe_error_fails(s3):
+    with Stubber(s3) as stubber:
+        stubber.add_client_error('head_bucket', service_error_code='403', http_status_code=403)
+        
+        assert not s3_bucket_setup.create_bucket(s3, 'gold-bucket', 'us-west-2', 'gold', KMS_KEY_ARN)
+        stubber.assert_no_pending_responses()
+
+
+def test_failed_step_stops_bucket_configuration(s3):
+    with Stubber(s3) as stubber:
+        stubber.add_response('head_bucket', {}, {'Bucket': 'gold-bucket'})
+        stubber.add_client_error(
+            'put_bucket_versioning',
+            service_error_code='OperationAborted',
+            http_status_code=409
+        )
+        
+        assert not s3_bucket_setup.create_bucket(s3, 'gold-bucket', 'us-west-2', 'gold', KMS_KEY_ARN)
+        stubber.assert_no_pending_responses()
+
+
+@pytest.fixture
+def cfn():
+    """CloudFormation client with fake credentials so no request ever leaves the stubber"""
+    return boto3.client(
+        'cloudformation',
+        region_name='us-west-2',
+        aws_access_key_id='testing',
+        aws_secret_access_key='testing'
+    )
+
+
+def test_rolled_back_stack_is_not_updated(cfn):
+    with Stubber(cfn) as stubber:
+        stubber.add_response(
+            'describe_stacks',
+            {
+                'Stacks': [
+                    {
+                        'StackName': s3_bucket_setup.STACK_NAME,
+                        'CreationTime': '2026-01-01T00:00:00Z',
+                        'StackStatus': 'ROLLBACK_COMPLETE'
+                    }
+                ]
+            },
+            {'StackName': s3_bucket_setup.STACK_NAME}
+        )
+        # An update_stack call would fail: it is not stubbed
+        assert not s3_bucket_setup.deploy_data_lake_stack(cfn, {'gold': 'gold-bucket'})
+        stubber.assert_no_pending_responses()